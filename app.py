@@ -70,4 +70,6 @@ async def heartbeat_api():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import uvloop
+    uvloop.install()
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
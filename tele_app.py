@@ -1,16 +1,33 @@
 import os
 from fastapi import FastAPI, HTTPException, Depends, Body, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from telethon import TelegramClient, functions, types, events
 from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
-from telethon.tl.types import InputPeerUser, InputPeerChannel
+from telethon.errors import (
+    SessionPasswordNeededError,
+    PhoneCodeInvalidError,
+    FloodWaitError,
+    ChannelInvalidError,
+)
+from telethon.tl.functions import PingRequest
 from telethon.tl.functions.channels import InviteToChannelRequest
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
-import shutil
-import base64
-from uuid import uuid4
+from collections import OrderedDict
+import asyncio
+import binascii
+import random
+import re
+import secrets
+import threading
+import time
+import aiofiles
+import anyio.to_thread
+import cachetools
+from blake3 import blake3
 
 
 app = FastAPI()
@@ -51,35 +68,123 @@ class TwoFAPassword(BaseModel):
     password: str
     session_hash: str
 
+# One pattern and one handler shared by every client: re-defining the
+# closure per client compiled the regex again and kept a distinct
+# function object alive for each pooled client.
+PING_PATTERN = re.compile(r'^/ping$')
+
+async def ping_handler(event):
+    await event.reply('pong')
+
+class ClientLFUCache(cachetools.LFUCache):
+    """Client pool that disconnects evicted clients on a background task."""
+
+    def popitem(self):
+        key, client = super().popitem()
+        send_worker = getattr(client, "_send_worker", None)
+        if send_worker is not None:
+            send_worker.cancel()
+        asyncio.create_task(client.disconnect())
+        return key, client
+
 class TelegramClientManager:
+    # Cap the pool and disconnect clients nobody has used for a while,
+    # so many /create_session calls can't exhaust memory or sockets.
+    # Eviction is LFU: a small hot set of sessions dominates traffic, and
+    # one burst of new sessions shouldn't flush it the way LRU would.
+    MAX_CLIENTS = 256
+    IDLE_TIMEOUT = 15 * 60  # seconds
+    IDLE_SWEEP_INTERVAL = 60  # seconds
+    HEARTBEAT_INTERVAL = 30  # seconds
+    RECONNECT_TIMEOUT = 2  # seconds
+
     def __init__(self):
-        self.clients = {}
+        self.clients = ClientLFUCache(maxsize=self.MAX_CLIENTS)
+        # Bot clients are rarely called but must outlive traffic bursts,
+        # so they live outside the evictable pool.
+        self.pinned = {}
+        self.last_used = {}
         self.app_id = None
         self.app_hash = None
+        self._idle_reaper = None
+        self._heartbeat_task = None
+
+    @staticmethod
+    def _session_key(session_hash: str) -> int:
+        # Pool keys are 64-bit digests so lookups don't re-hash the full
+        # StringSession string (hundreds of chars) on every request.
+        return hash(session_hash) & 0xFFFFFFFFFFFFFFFF
 
     async def add_message_handler(self, client):
-        @client.on(events.NewMessage(pattern='/ping'))
-        async def ping_handler(event):
-            await event.reply('pong')
+        client.add_event_handler(ping_handler, events.NewMessage(pattern=PING_PATTERN))
 
     async def get_client(self, session_hash: str):
-        if session_hash not in self.clients:
+        key = self._session_key(session_hash)
+        client = self.pinned.get(key)
+        if client is None:
+            client = self.clients.get(key)
+        if client is None:
             raise HTTPException(status_code=400, detail="Session not found")
-        return self.clients[session_hash]
+        self.last_used[key] = time.monotonic()
+        # Reconnect dropped sockets here so callers never pay for a dead
+        # client on their first request after a disconnect.
+        if not client.is_connected():
+            await asyncio.wait_for(client.connect(), timeout=self.RECONNECT_TIMEOUT)
+        return client
+
+    async def register_client(self, session_hash: str, client, pinned: bool = False):
+        key = self._session_key(session_hash)
+        if pinned:
+            self.pinned[key] = client
+        else:
+            # The LFU cache evicts (and disconnects) on overflow itself
+            self.clients[key] = client
+        self.last_used[key] = time.monotonic()
+        if self._idle_reaper is None:
+            self._idle_reaper = asyncio.create_task(self._reap_idle_clients())
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def _reap_idle_clients(self):
+        while True:
+            await asyncio.sleep(self.IDLE_SWEEP_INTERVAL)
+            cutoff = time.monotonic() - self.IDLE_TIMEOUT
+            idle_keys = [k for k, ts in self.last_used.items() if ts < cutoff]
+            for key in idle_keys:
+                if key in self.clients:
+                    await self._remove_by_key(key)
+                elif key not in self.pinned:
+                    # Already evicted by the LFU cache; drop the stale ts
+                    self.last_used.pop(key, None)
+
+    async def _heartbeat(self):
+        # Keep the MTProto sockets warm so reused clients don't pay a
+        # reconnect (TCP handshake + key exchange) on their next request.
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            for client in [*self.clients.values(), *self.pinned.values()]:
+                if not client.is_connected():
+                    continue
+                try:
+                    await client(PingRequest(ping_id=random.getrandbits(63)))
+                except Exception:
+                    pass
 
     async def create_client(self, session_hash: str = None):
         if not self.app_id or not self.app_hash:
             raise ValueError("API credentials not set")
         
-        if session_hash and session_hash in self.clients:
-            return session_hash
+        if session_hash:
+            key = self._session_key(session_hash)
+            if key in self.clients or key in self.pinned:
+                return session_hash
 
         session = StringSession(session_hash) if session_hash else StringSession()
         client = TelegramClient(session, self.app_id, self.app_hash)
         await client.connect()
 
         new_hash = session.save()
-        self.clients[new_hash] = client
+        await self.register_client(new_hash, client)
         await self.add_message_handler(client)
         return new_hash
 
@@ -92,19 +197,128 @@ class TelegramClientManager:
         await client.start(bot_token=bot_token)
 
         new_hash = session.save()
-        self.clients[new_hash] = client
+        await self.register_client(new_hash, client, pinned=True)
         await self.add_message_handler(client)
         return new_hash
 
     async def remove_client(self, session_hash: str):
-        if session_hash in self.clients:
-            await self.clients[session_hash].disconnect()
-            del self.clients[session_hash]
+        await self._remove_by_key(self._session_key(session_hash))
+
+    async def _remove_by_key(self, key: int):
+        client = self.pinned.pop(key, None)
+        if client is None:
+            client = self.clients.pop(key, None)
+        if client is None:
+            return
+        self.last_used.pop(key, None)
+        send_worker = getattr(client, "_send_worker", None)
+        if send_worker is not None:
+            send_worker.cancel()
+        await client.disconnect()
 
     async def disconnect_all(self):
-        for client in self.clients.values():
-            await client.disconnect()
+        if self._idle_reaper is not None:
+            self._idle_reaper.cancel()
+            self._idle_reaper = None
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        clients = [*self.clients.values(), *self.pinned.values()]
+        for client in clients:
+            send_worker = getattr(client, "_send_worker", None)
+            if send_worker is not None:
+                send_worker.cancel()
+        # Disconnect concurrently: done sequentially, shutdown with a full
+        # pool takes one TCP teardown round-trip per client
+        await asyncio.gather(
+            *(client.disconnect() for client in clients), return_exceptions=True
+        )
         self.clients.clear()
+        self.pinned.clear()
+        self.last_used.clear()
+
+# Resolved usernames/channels are memoized per client so hot paths like
+# /send_message don't pay a round-trip to Telegram for every request.
+ENTITY_CACHE_SIZE = 1024
+
+async def cached_get_entity(client, key):
+    cache = getattr(client, "_resolved_entities", None)
+    if cache is None:
+        cache = client._resolved_entities = OrderedDict()
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    entity = await client.get_entity(key)
+    cache[key] = entity
+    while len(cache) > ENTITY_CACHE_SIZE:
+        cache.popitem(last=False)
+    return entity
+
+def invalidate_entity(client, key):
+    """Drop a memoized entity that turned out to be stale or throttled, so
+    the next request re-resolves it."""
+    cache = getattr(client, "_resolved_entities", None)
+    if cache is not None:
+        cache.pop(key, None)
+
+# Sends queued within a short window go out together with one gather on
+# the same connection, so MTProto can pack them into fewer containers.
+SEND_BATCH_WINDOW = 0.005  # seconds
+SEND_BATCH_MAX = 32
+
+async def batched_send_message(client, entity, message):
+    queue = getattr(client, "_send_queue", None)
+    if queue is None:
+        queue = client._send_queue = asyncio.Queue()
+        client._send_worker = asyncio.create_task(drain_send_queue(client, queue))
+    future = asyncio.get_running_loop().create_future()
+    queue.put_nowait((entity, message, future))
+    # The worker may have been cancelled (LFU eviction) between get_client
+    # and this enqueue, after its shutdown drain already ran — nothing
+    # drains the queue then, so fail the future instead of hanging.
+    if client._send_worker.done() and not future.done():
+        future.set_exception(
+            ConnectionError("Client was disconnected before the message could be sent")
+        )
+    return await future
+
+async def drain_send_queue(client, queue):
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + SEND_BATCH_WINDOW
+            while len(batch) < SEND_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            results = await asyncio.gather(
+                *(client.send_message(entity, message) for entity, message, _ in batch),
+                return_exceptions=True,
+            )
+            for (_, _, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            batch = []
+    finally:
+        # The worker is cancelled when its client leaves the pool. Fail
+        # every future still in flight or queued so the /send_message
+        # requests awaiting them don't hang forever.
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        error = ConnectionError("Client was disconnected before the message could be sent")
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
 
 client_manager = TelegramClientManager()
 
@@ -113,7 +327,24 @@ async def lifespan(app: FastAPI):
     yield
     await client_manager.disconnect_all()
 
-app = FastAPI(lifespan=lifespan)
+# orjson serializes the small JSON responses several times faster than
+# the stdlib encoder, which adds up on hot paths like /send_message.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Compress larger JSON payloads (e.g. bot_info); tiny responses aren't
+# worth the gzip overhead.
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# One pair of global handlers replaces the try/except boilerplate that
+# wrapped every endpoint just to re-raise as HTTPException. ValueError
+# keeps its 400 mapping; anything else unexpected becomes a 500.
+@app.exception_handler(ValueError)
+async def value_error_handler(request, exc):
+    return ORJSONResponse({"detail": str(exc)}, status_code=400)
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request, exc):
+    return ORJSONResponse({"detail": str(exc)}, status_code=500)
 
 async def get_client():
     return await client_manager.get_client()
@@ -122,13 +353,102 @@ async def get_client():
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Mount the uploads directory
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Partial uploads are staged outside the served tree so .part files are
+# never fetchable via /uploads, but on the same filesystem so the final
+# os.replace stays an atomic rename.
+UPLOAD_TMP_DIR = UPLOAD_DIR + ".tmp"
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# Mount the uploads directory. Skip the mount when a fronting proxy
+# serves /uploads itself (nginx sendfile streams the files zero-copy
+# from the kernel instead of through Python; see README).
+if not os.environ.get("UPLOADS_BEHIND_PROXY"):
+    app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 class Base64Image(BaseModel):
     filename: str
     base64_data: str
 
+# Copy uploads in 64 KB chunks so the event loop can service other
+# requests between writes.
+UPLOAD_CHUNK_SIZE = 65536
+
+# Decode base64 in 87380-char chunks (a multiple of 4, ~64 KB of binary)
+# so large uploads never materialize fully in memory and the event loop
+# can service other requests between chunks.
+BASE64_CHUNK_SIZE = 87380
+
+# Flush decoded chunks 16 at a time (~1 MB) with a single writev: one
+# syscall submits the whole batch instead of one write per chunk.
+WRITEV_BATCH = 16
+
+def writev_all(fd, buffers):
+    """os.writev the buffers completely, resubmitting after a short write."""
+    while buffers:
+        written = os.writev(fd, buffers)
+        remaining = []
+        for buf in buffers:
+            if written >= len(buf):
+                written -= len(buf)
+            else:
+                remaining.append(memoryview(buf)[written:])
+                written = 0
+        buffers = remaining
+
+# Uploads are stored content-addressed: files land at
+# uploads/<digest[:2]>/<digest><ext>, so re-uploads of the same image
+# (avatars, stickers) resolve to the existing file without a second
+# write. The LRU remembers recent digests to skip even the stat call.
+# finalize_upload runs in threadpool workers and LRUCache is not
+# thread-safe, so every access takes the lock.
+dedup_cache = cachetools.LRUCache(maxsize=1024)
+dedup_cache_lock = threading.Lock()
+
+def new_temp_path():
+    """Time-ordered temp name in the unserved staging dir, kept on the
+    same filesystem so the final os.replace is an atomic rename."""
+    return os.path.join(UPLOAD_TMP_DIR, f".part-{time.time_ns():016x}{secrets.token_urlsafe(8)}")
+
+def discard_temp(tmp_path: str):
+    """Remove a temp file left behind by a failed upload."""
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+def finalize_upload(tmp_path: str, digest: str, file_extension: str) -> str:
+    """Move a finished temp file to its content-addressed path, or drop it
+    when an identical upload already exists. Returns the public URI."""
+    with dedup_cache_lock:
+        cached_uri = dedup_cache.get((digest, file_extension))
+    if cached_uri is not None:
+        os.unlink(tmp_path)
+        return cached_uri
+    shard_dir = os.path.join(UPLOAD_DIR, digest[:2])
+    os.makedirs(shard_dir, exist_ok=True)
+    unique_filename = f"{digest}{file_extension}"
+    file_path = os.path.join(shard_dir, unique_filename)
+    if os.path.exists(file_path):
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, file_path)
+        drop_page_cache(file_path)
+    file_uri = f"uploads/{digest[:2]}/{unique_filename}"
+    with dedup_cache_lock:
+        dedup_cache[(digest, file_extension)] = file_uri
+    return file_uri
+
+def drop_page_cache(file_path: str):
+    """Hint the kernel that a freshly written upload won't be re-read soon,
+    so its pages don't crowd out hotter data under concurrent uploads."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
 @app.post("/set_api_credentials")
 async def set_api_credentials(credentials: APICredentials):
     client_manager.app_id = credentials.app_id
@@ -137,85 +457,100 @@ async def set_api_credentials(credentials: APICredentials):
 
 @app.post("/upload_base64_image")
 async def upload_base64_image(image: Base64Image):
+    file_extension = os.path.splitext(image.filename)[1]
+    tmp_path = new_temp_path()
+    hasher = blake3()
+
+    # MIME-wrapped payloads embed newlines, which would misalign the
+    # fixed-width 4-char groups below; strip whitespace once up front
+    base64_data = image.base64_data
+    if any(ws in base64_data for ws in ("\n", "\r", " ", "\t")):
+        base64_data = "".join(base64_data.split())
+
+    # Decode chunk by chunk in the default executor and flush batches of
+    # decoded buffers with one vectorized writev from a worker thread, so
+    # the loop never blocks on the decode or the disk.
+    loop = asyncio.get_running_loop()
     try:
-        # Decode the base64 data
-        image_data = base64.b64decode(image.base64_data)
-        
-        # Generate a unique filename
-        file_extension = os.path.splitext(image.filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save the file
-        with open(file_path, "wb") as file:
-            file.write(image_data)
-        
-        # Generate the URI
-        file_uri = f"uploads/{unique_filename}"
-        
-        return {"file_uri": file_uri, "message": "Image uploaded successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            buffers = []
+            for offset in range(0, len(base64_data), BASE64_CHUNK_SIZE):
+                chunk = base64_data[offset:offset + BASE64_CHUNK_SIZE]
+                decoded = await loop.run_in_executor(None, binascii.a2b_base64, chunk)
+                hasher.update(decoded)
+                buffers.append(decoded)
+                if len(buffers) >= WRITEV_BATCH:
+                    await anyio.to_thread.run_sync(writev_all, fd, buffers)
+                    buffers = []
+            if buffers:
+                await anyio.to_thread.run_sync(writev_all, fd, buffers)
+        finally:
+            os.close(fd)
+
+        file_uri = await run_in_threadpool(
+            finalize_upload, tmp_path, hasher.hexdigest(), file_extension
+        )
+    except BaseException:
+        # A decode error, write failure, or client disconnect must not
+        # leak the temp file
+        discard_temp(tmp_path)
+        raise
+    return {"file_uri": file_uri, "message": "Image uploaded successfully"}
 
 @app.post("/upload_image")
 async def upload_image(file: UploadFile = File(...)):
+    file_extension = os.path.splitext(file.filename)[1]
+
+    # Save the file chunk by chunk, hashing as we go
+    tmp_path = new_temp_path()
+    hasher = blake3()
     try:
-        # Generate a unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Generate the URI
-        file_uri = f"uploads/{unique_filename}"
-        
-        return {"file_uri": file_uri, "message": "Image uploaded successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                await buffer.write(chunk)
+        file_uri = await run_in_threadpool(
+            finalize_upload, tmp_path, hasher.hexdigest(), file_extension
+        )
+    except BaseException:
+        # A write failure or client disconnect must not leak the temp file
+        discard_temp(tmp_path)
+        raise
+
+    return {"file_uri": file_uri, "message": "Image uploaded successfully"}
 
 @app.post("/verify_2fa")
 async def verify_2fa(two_fa: TwoFAPassword):
-    try:
-        client = await client_manager.get_client(two_fa.session_hash)
-        await client.sign_in(password=two_fa.password)
-        user = await client.get_me()
-        return {"message": f"Authenticated as {user.first_name}", "session_hash": two_fa.session_hash}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    client = await client_manager.get_client(two_fa.session_hash)
+    await client.sign_in(password=two_fa.password)
+    user = await client.get_me()
+    return {"message": f"Authenticated as {user.first_name}", "session_hash": two_fa.session_hash}
 
 @app.post("/create_session")
 async def create_session(phone_number: PhoneNumber):
     if not client_manager.app_id or not client_manager.app_hash:
         raise HTTPException(status_code=400, detail="API credentials not set. Please call /set_api_credentials first.")
     
-    try:
-        session_hash = await client_manager.create_client()
-        client = await client_manager.get_client(session_hash)
-        result = await client.send_code_request(phone_number.phone, force_sms=True)
-        return {"session_hash": session_hash, "phone_code_hash": result.phone_code_hash}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    session_hash = await client_manager.create_client()
+    client = await client_manager.get_client(session_hash)
+    result = await client.send_code_request(phone_number.phone, force_sms=True)
+    return {"session_hash": session_hash, "phone_code_hash": result.phone_code_hash}
 
 @app.post("/create_bot_session")
 async def create_bot_session(bot_token: BotToken):
-    try:
-        session_hash = await client_manager.create_bot_client(bot_token.token)
-        client = await client_manager.get_client(session_hash)
-        bot_info = await client.get_me()
-        return {
-            "session_hash": session_hash,
-            "bot_info": {
-                "id": bot_info.id,
-                "first_name": bot_info.first_name,
-                "username": bot_info.username,
-                "bot": bot_info.bot
-            }
+    session_hash = await client_manager.create_bot_client(bot_token.token)
+    client = await client_manager.get_client(session_hash)
+    bot_info = await client.get_me()
+    return {
+        "session_hash": session_hash,
+        "bot_info": {
+            "id": bot_info.id,
+            "first_name": bot_info.first_name,
+            "username": bot_info.username,
+            "bot": bot_info.bot
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    }
 
 @app.post("/verify_otp")
 async def verify_otp(
@@ -235,68 +570,77 @@ async def verify_otp(
         return {"message": "Two-step verification is enabled. Please provide the password.", "session_hash": session.hash}
     except PhoneCodeInvalidError:
         raise HTTPException(status_code=401, detail="Invalid code provided.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+# Built once: every story uses the same privacy rules, so there's no
+# reason to allocate fresh rule objects per request.
+ALLOW_CONTACTS_PRIVACY = (types.InputPrivacyValueAllowContacts(),)
 
 @app.post("/send_story")
 async def send_story(story_request: StoryRequest, session: SessionHash):
+    client = await client_manager.get_client(session.hash)
+    if not await client.is_user_authorized():
+        raise HTTPException(status_code=401, detail="Unauthorized. Please authenticate first.")
+    # Start the file upload right away so it overlaps the get_me
+    # round-trip instead of waiting behind it
+    upload_task = asyncio.create_task(client.upload_file(story_request.file_path))
     try:
-        client = await client_manager.get_client(session.hash)
-        if not await client.is_user_authorized():
-            raise HTTPException(status_code=401, detail="Unauthorized. Please authenticate first.")
-        me = await client.get_me()    
+        me = await client.get_me()
         result = await client(functions.stories.SendStoryRequest(
             peer=me.id,
             media=types.InputMediaUploadedPhoto(
-                file=await client.upload_file(story_request.file_path),
+                file=await upload_task,
                 spoiler=story_request.spoiler,
                 ttl_seconds=story_request.ttl_seconds
             ),
-            privacy_rules=[types.InputPrivacyValueAllowContacts()]
+            privacy_rules=ALLOW_CONTACTS_PRIVACY
         ))
-        return {"message": "Story sent successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        # Don't orphan the upload if get_me or the story request fails
+        upload_task.cancel()
+        raise
+    return {"message": "Story sent successfully"}
 
 @app.post("/send_message")
 async def send_message(message_request: MessageRequest):
+    client = await client_manager.get_client(message_request.session_hash)
+
+    # Try to interpret the recipient as an integer (user ID) first.
+    # get_input_entity answers from the session's entity cache without
+    # a network call for any peer the client has already seen, unlike
+    # InputPeerUser(id, 0) which forces Telethon to re-resolve.
     try:
-        client = await client_manager.get_client(message_request.session_hash)
-        
-        # Try to interpret the recipient as an integer (user ID) first
-        try:
-            recipient_id = int(message_request.recipient)
-            entity = InputPeerUser(recipient_id, 0)
-        except ValueError:
-            # If it's not an integer, treat it as a username or channel
-            entity = await client.get_entity(message_request.recipient)
-        
-        # Send the message
-        result = await client.send_message(entity, message_request.message)
-        
-        return {"message": "Message sent successfully", "message_id": result.id}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        entity = await client.get_input_entity(int(message_request.recipient))
+    except ValueError:
+        # If it's not an integer, treat it as a username or channel
+        entity = await cached_get_entity(client, message_request.recipient)
+
+    # Send the message through the client's batching queue
+    try:
+        result = await batched_send_message(client, entity, message_request.message)
+    except (FloodWaitError, ChannelInvalidError):
+        invalidate_entity(client, message_request.recipient)
+        raise
+
+    return {"message": "Message sent successfully", "message_id": result.id}
 
 @app.post("/join_channel")
 async def join_channel(request: JoinChannelRequest):
+    client = await client_manager.get_client(request.session_hash)
+
+    # Get the channel entity
+    channel = await cached_get_entity(client, request.channel)
+
+    # Join the channel
     try:
-        client = await client_manager.get_client(request.session_hash)
-        
-        # Get the channel entity
-        channel = await client.get_entity(request.channel)
-        
-        # Join the channel
         await client(InviteToChannelRequest(channel, [client.get_me()]))
-        
-        return {"message": f"Successfully joined channel {request.channel}"}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except (FloodWaitError, ChannelInvalidError):
+        invalidate_entity(client, request.channel)
+        raise
+
+    return {"message": f"Successfully joined channel {request.channel}"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import uvloop
+    uvloop.install()
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")